@@ -1,7 +1,11 @@
 import abc
 import csv
-from collections import defaultdict
-from random import choice, randint
+import logging
+from collections import Counter
+from functools import lru_cache
+from random import choice, randint, sample
+
+logger = logging.getLogger(__name__)
 
 
 class Environment:
@@ -20,7 +24,11 @@ class Environment:
     """
 
     def __init__(self):
-        self._cells = defaultdict(lambda: defaultdict(lambda: defaultdict(dict)))
+        # flat mapping of (x, y, z) -> {phero: value}, cells only exist once written
+        self._cells = {}
+        # positions of the cells still holding some pheromone, the only ones that
+        # need to be visited when evaporating
+        self._active = set()
 
     def __setitem__(self, key, value):
         """Set the value of a pheromone in a cell of the environment.
@@ -30,9 +38,29 @@ class Environment:
         """
         try:
             x, y, z, phero = key
-            self._cells[x][y][z][phero] = value
-        except ValueError:
+        except (TypeError, ValueError):
             raise TypeError("key should be (x, y, z, phero)")
+        self._cells.setdefault((x, y, z), {})[phero] = value
+        if value:
+            self._active.add((x, y, z))
+
+    def bulk_set(self, positions, pheromone, value):
+        """Set the same value of a pheromone in many cells of the environment.
+
+        :param positions: iterable of (x, y, z) positions
+        :param pheromone: the pheromone to set
+        :param value: the value of the pheromone in each of the given cells
+        """
+        cells = self._cells
+        active = self._active
+        for position in positions:
+            cell = cells.get(position)
+            if cell is None:
+                cells[position] = {pheromone: value}
+            else:
+                cell[pheromone] = value
+            if value:
+                active.add(position)
 
     def __getitem__(self, key):
         """Get the cell at the given coordinates, the key can be one of (x, y, z,
@@ -42,40 +70,91 @@ class Environment:
         :return: for (x, y, z, phero) returns the value of the pheromone at (x,
         y, z); for (x, y, z) returns a dict of phero: value; None if the cell is empty
         """
-        try:
-            x, y, z, phero = key
-            return self._cells[x][y][z].get(phero)
-        except ValueError:
-            try:
-                x, y, z = key
-                return self._cells[x][y][z] or None
-            except ValueError:
-                raise TypeError("key should be (x, y, z, phero) or (x, y, z)")
+        if isinstance(key, tuple):
+            if len(key) == 4:
+                x, y, z, phero = key
+                cell = self._cells.get((x, y, z))
+                return None if cell is None else cell.get(phero)
+            if len(key) == 3:
+                return self._cells.get(key) or None
+        raise TypeError("key should be (x, y, z, phero) or (x, y, z)")
+
+    def is_occupied(self, x, y, z):
+        """Whether the cell at the given coordinates has ever been written to, i.e.
+        whether it holds a cube. Cells stay occupied once their pheromones have
+        evaporated.
+
+        :param x: x coordinate of the cell
+        :param y: y coordinate of the cell
+        :param z: z coordinate of the cell
+        :return: True if the cell is occupied, False otherwise
+        """
+        return (x, y, z) in self._cells
+
+    @property
+    def occupied(self):
+        """Live, set-like view of the occupied positions, see `is_occupied`. Membership
+        tests on it avoid a method call per position in hot loops.
+        """
+        return self._cells.keys()
 
     def evaporate(self, value=0.05):
         """For all positions, evaporate all pheromones by the given value. Capped at 0.
 
         :param value: how much to remove from each pheromones
         """
-        for k1, v1 in self._cells.items():
-            for k2, v2 in v1.items():
-                for k3, v3 in v2.items():
-                    for phero, val in v3.items():
-                        self._cells[k1][k2][k3][phero] = max(0, val - value)
-
-    def export(self, path, pheromone):
+        exhausted = []
+        for position in self._active:
+            cell = self._cells[position]
+            remaining = False
+            for phero, val in cell.items():
+                if val > value:
+                    cell[phero] = val - value
+                    remaining = True
+                elif val:
+                    # already evaporated pheromones are left untouched
+                    cell[phero] = 0
+            if not remaining:
+                exhausted.append(position)
+        self._active.difference_update(exhausted)
+
+    def export(self, path, pheromone=None):
         """Export the environment as a CSV file
 
         :param path: the path to export the file
-        :param pheromone: only position having this pheromone will be exported
+        :param pheromone: only position having this pheromone will be exported, all
+        the occupied positions are exported if None
         """
+        if pheromone is None:
+            positions = self._cells.keys()
+        else:
+            positions = (
+                position for position, cell in self._cells.items() if pheromone in cell
+            )
         with open(path, "w") as f:
-            writer = csv.writer(f)
-            for x, v1 in self._cells.items():
-                for y, v2 in v1.items():
-                    for z, v3 in v2.items():
-                        if pheromone in v3:
-                            writer.writerow((x, y, z))
+            csv.writer(f).writerows(positions)
+
+
+@lru_cache(maxsize=None)
+def _adjacent_offsets(increment, height):
+    """
+    :param increment: how many units around a position to use
+    :param height: how many units a position is above the ground, clamped to
+    [-increment - 1, increment] since all the heights outside of it share the same
+    offsets
+    :return: tuple of all the (dx, dy, dz) offsets to the positions that are
+    'increment' unit around a position of the given height and not under the
+    ground, excluding (0, 0, 0)
+    """
+    increments = range(-increment, increment + 1)
+    return tuple(
+        (dx, dy, dz)
+        for dx in increments
+        for dy in increments
+        if dy >= -height
+        for dz in increments
+        if dx or dy or dz
+    )
 
 
 def adjacent_positions(position, increment=1):
@@ -87,23 +166,11 @@ def adjacent_positions(position, increment=1):
     under the ground (y >=0) and are not the original position
     """
     x, y, z = position
-    for x_increment in range(x - increment, x + increment + 1):
-        for y_increment in range(y - increment, y + increment + 1):
-            for z_increment in range(z - increment, z + increment + 1):
-                if (x_increment, y_increment, z_increment) != position and (
-                    y_increment
-                ) >= 0:
-                    yield x_increment, y_increment, z_increment
-
-
-transformations = [
-    lambda x, y, z: (x, y + 1, z),
-    lambda x, y, z: (x, y - 1, z),
-    lambda x, y, z: (x + 1, y, z),
-    lambda x, y, z: (x - 1, y, z),
-    lambda x, y, z: (x, y, z + 1),
-    lambda x, y, z: (x, y, z - 1),
-]
+    # the offsets are specific to the height of the position so that none of them
+    # goes under the ground and there is nothing left to check per position
+    height = max(min(y, increment), -increment - 1)
+    for dx, dy, dz in _adjacent_offsets(increment, height):
+        yield x + dx, y + dy, z + dz
 
 
 def direct_neighbors(position):
@@ -111,9 +178,17 @@ def direct_neighbors(position):
     coordinate at a time i.e. no diagonal.
 
     :param position: position for which we want direct neighbors
-    :return: list of direct neighboring positions
+    :return: tuple of direct neighboring positions
     """
-    return [transformation(*position) for transformation in transformations]
+    x, y, z = position
+    return (
+        (x, y + 1, z),
+        (x, y - 1, z),
+        (x + 1, y, z),
+        (x - 1, y, z),
+        (x, y, z + 1),
+        (x, y, z - 1),
+    )
 
 
 def pheromone_attractiveness(position, environment, pheromones):
@@ -125,14 +200,77 @@ def pheromone_attractiveness(position, environment, pheromones):
     :param pheromones: the names of the pheromones to compute attractiveness for
     :return: dict of pheromone:value
     """
-    neighbors = direct_neighbors(position)
-    return {
-        phero: sum(environment[x, y, z, phero] or 0 for x, y, z in neighbors)
-        for phero in pheromones
-    }
+    attractiveness = dict.fromkeys(pheromones, 0)
+    # read each neighboring cell once and accumulate all of its pheromones
+    for x, y, z in direct_neighbors(position):
+        cell = environment[x, y, z]
+        if cell:
+            for phero in pheromones:
+                attractiveness[phero] += cell.get(phero) or 0
+    return attractiveness
+
+
+def _most_attractive_pheromone(cells, pheromones):
+    """Return the pheromone that is the most present in the given cells, on ties the
+    first one in `pheromones` wins.
+
+    :param cells: the non empty cells to consider
+    :param pheromones: the names of the pheromones to compute attractiveness for
+    :return: tuple (pheromone, value)
+    """
+    best_phero, best_value = None, None
+    for phero in pheromones:
+        value = 0
+        for cell in cells:
+            value += cell.get(phero) or 0
+        if best_value is None or value > best_value:
+            best_phero, best_value = phero, value
+    return best_phero, best_value
+
+
+def pheromone_attractiveness_argmax(position, environment, pheromones):
+    """Return the most attractive pheromone of the position and its attractiveness,
+    see `pheromone_attractiveness`. On ties the first pheromone of `pheromones` wins.
+
+    :param position: the position to consider
+    :param environment: the environment in which to calculate the attractiveness
+    :param pheromones: the names of the pheromones to compute attractiveness for
+    :return: tuple (pheromone, value)
+    """
+    occupied = environment.occupied
+    neighbors = [
+        environment[neighbor]
+        for neighbor in direct_neighbors(position)
+        if neighbor in occupied
+    ]
+    return _most_attractive_pheromone(neighbors, pheromones)
+
+
+def positions_attractiveness_argmax(positions, environment, pheromones):
+    """Return the most attractive pheromone of all the given positions and its
+    attractiveness, see `pheromone_attractiveness_argmax`. Only occupied neighboring
+    cells are read from the environment.
+
+    :param positions: the positions to consider
+    :param environment: the environment in which to calculate the attractiveness
+    :param pheromones: the names of the pheromones to compute attractiveness for
+    :return: dict of position:(pheromone, value)
+    """
+    occupied = environment.occupied
+    attractiveness = {}
+    for position in positions:
+        neighbors = [
+            environment[neighbor]
+            for neighbor in direct_neighbors(position)
+            if neighbor in occupied
+        ]
+        attractiveness[position] = _most_attractive_pheromone(neighbors, pheromones)
+    return attractiveness
 
 
 class Agent(abc.ABC):
+    __slots__ = ("_position", "_range")
+
     def __init__(self, position, action_range=1):
         """
         :param position: (x, y, z) starting position of the Agent
@@ -163,32 +301,37 @@ class Agent(abc.ABC):
 
 
 class Ant(Agent):
+    __slots__ = ("_alpha", "_action_counts", "_pheromones")
+
     def __init__(self, position, alpha=0.25, action_range=1, pheromones=None):
         super().__init__(position, action_range)
         self._alpha = alpha
-        self._actions = []
+        self._action_counts = Counter()
         self._pheromones = pheromones or ["move", "build"]
 
     def _filter_adjacent_positions(self, positions, environment):
-        for position in positions:
-            x, y, z = position
-            # we can't move/build to our own position or a cell that's already occupied
-            if position == self._position or environment[x, y, z]:
-                continue
-            # on the ground
-            if y == 0:
-                yield position
-            # one of direct neighboring cells of 'position' is a cube so we can
-            # "attach" to it
-            for (xx, yy, zz) in direct_neighbors(position):
-                if environment[xx, yy, zz]:
-                    yield position
+        occupied = environment.occupied
+        return [
+            position
+            for position in positions
+            # we can't move/build to our own position or a cell that's already
+            # occupied
+            if position != self._position and position not in occupied
+            # on the ground or one of direct neighboring cells of 'position' is a
+            # cube so we can "attach" to it
+            and (
+                position[1] == 0 or not occupied.isdisjoint(direct_neighbors(position))
+            )
+        ]
 
     def _selection_action(self, environment, possible_positions):
-        positions_pheromone = {
-            pos: pheromone_attractiveness(pos, environment, self._pheromones)
-            for pos in possible_positions
-        }
+        # shuffling the pheromones once breaks ties between them randomly for the
+        # position eventually picked
+        positions_pheromone = positions_attractiveness_argmax(
+            possible_positions,
+            environment,
+            sample(self._pheromones, len(self._pheromones)),
+        )
         if not positions_pheromone:
             # if there's no available positions, randomly positions the ant on
             # the floor
@@ -206,40 +349,47 @@ class Ant(Agent):
         ) = self._get_most_attractive_position(positions_pheromone)
 
         if highest_pheromone == "move":
-            print(f"moving to {most_attractive_position}")
+            logger.debug("moving to %s", most_attractive_position)
             self._position = most_attractive_position
-            self._actions.append("move")
+            self._action_counts["move"] += 1
         elif highest_pheromone == "build":
             x, y, z = most_attractive_position
             # we cannot build if there are nothing around us/build phero value = 0
             if phero_attractiveness != 0:
-                print(f"building to {most_attractive_position}")
-                self._actions.append("build")
+                logger.debug("building to %s", most_attractive_position)
+                self._action_counts["build"] += 1
                 for phero in self._pheromones:
                     environment[x, y, z, phero] = 1
 
     def _get_most_attractive_position(self, positions_pheromone):
         """
-        :param positions_pheromone: (position, {phero: value} for all valid position
-        the agent can reach/act on
+        :param positions_pheromone: {position: (pheromone, value)} for all valid
+        position the agent can reach/act on, see `positions_attractiveness_argmax`
         :return: a randomly chosen position which has the highest pheromone value as
         a tuple (position, highest pheromone, value of pheromone attractiveness)
         """
-        most_attractive_positions = sorted(
-            positions_pheromone.items(), key=lambda item: max(item[1].values())
-        )
-        max_phero_value = max(most_attractive_positions[-1][1].values())
+        max_phero_value = None
+        most_attractive_positions = []
+        for pos, (_, value) in positions_pheromone.items():
+            if max_phero_value is None or value > max_phero_value:
+                max_phero_value = value
+                most_attractive_positions = [pos]
+            elif value == max_phero_value:
+                most_attractive_positions.append(pos)
         # randomly select any position that has a pheromone value equal to the max
-        (most_attractive_position, pheros) = choice(
-            [
-                (pos, pheros)
-                for pos, pheros in most_attractive_positions
-                if max(pheros.values()) == max_phero_value
-            ]
-        )
-        # randomly pick the pheromone, at the current position, that has the highest
-        # value
-        highest_pheromone = choice(
-            [k for k, v in pheros.items() if v == max_phero_value]
-        )
+        most_attractive_position = choice(most_attractive_positions)
+        highest_pheromone = positions_pheromone[most_attractive_position][0]
         return most_attractive_position, highest_pheromone, max_phero_value
+
+
+def step(agents, environment, evaporation=0.05):
+    """Advance the simulation by one tick: every agent acts once, in order, then the
+    pheromones of the environment evaporate.
+
+    :param agents: the agents evolving in the environment
+    :param environment: the environment in which the agents evolve
+    :param evaporation: how much pheromone evaporates at the end of the tick
+    """
+    for agent in agents:
+        agent.act(environment)
+    environment.evaporate(evaporation)
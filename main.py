@@ -1,27 +1,19 @@
-from collections import defaultdict
+from collections import Counter
 
-from ant import Ant, Environment
+from ant import Ant, Environment, step
 
 if __name__ == "__main__":
     env = Environment()
-    env[1, 0, 0, "move"] = 1
-    env[1, 0, 0, "build"] = 1
-
-    for i in range(25):
-        env[1, i, 0, "build"] = 1
-        env[1, i, 0, "move"] = 1
+    column = [(1, i, 0) for i in range(25)]
+    env.bulk_set(column, "build", 1)
+    env.bulk_set(column, "move", 1)
 
     ants = [Ant((0, 0, 0)) for _ in range(10)]
 
     for _ in range(75):
-        for ant in ants:
-            ant.act(env)
-        env.evaporate()
+        step(ants, env)
 
-    actions = defaultdict(int)
-    for ant in ants:
-        for action in ant._actions:
-            actions[action] += 1
+    actions = sum((ant._action_counts for ant in ants), Counter())
 
     print(actions)
 
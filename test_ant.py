@@ -2,7 +2,16 @@ import os
 import tempfile
 import unittest
 
-from ant import Ant, Environment, adjacent_positions, direct_neighbors
+from ant import (
+    Ant,
+    Environment,
+    adjacent_positions,
+    direct_neighbors,
+    pheromone_attractiveness,
+    pheromone_attractiveness_argmax,
+    positions_attractiveness_argmax,
+    step,
+)
 
 
 class EnvTest(unittest.TestCase):
@@ -20,12 +29,28 @@ class EnvTest(unittest.TestCase):
         self.assertEqual(env[0, 0, 0, "pheromone-1"], 12)
         self.assertEqual(len(env._cells), 1)
 
+    def test_bulk_set(self):
+        env = Environment()
+        env[0, 0, 0, "pheromone-1"] = 12
+        env.bulk_set([(0, 0, 0), (1, 0, 0), (2, 0, 0)], "pheromone-2", 3)
+        self.assertDictEqual(env[0, 0, 0], {"pheromone-1": 12, "pheromone-2": 3})
+        self.assertDictEqual(env[1, 0, 0], {"pheromone-2": 3})
+        self.assertDictEqual(env[2, 0, 0], {"pheromone-2": 3})
+        self.assertEqual(len(env._cells), 3)
+
     def test_get_empty_cell(self):
         env = Environment()
         self.assertEqual(len(env._cells), 0)
         self.assertIsNone(env[0, 0, 0, "pheromone-1"])
         self.assertIsNone(env[0, 0, 0])
 
+    def test_get_does_not_create_cell(self):
+        env = Environment()
+        env[0, 0, 0, "pheromone-1"] = 12
+        _ = env[1, 0, 0, "pheromone-1"]
+        _ = env[0, 1, 0]
+        self.assertEqual(len(env._cells), 1)
+
     def test_get_pheromone(self):
         env = Environment()
         env[0, 0, 0, "pheromone-1"] = 12
@@ -57,6 +82,23 @@ class EnvTest(unittest.TestCase):
         with self.assertRaises(TypeError):
             env[0, 1, 2, 3, 4] = 12
 
+    def test_is_occupied(self):
+        env = Environment()
+        self.assertFalse(env.is_occupied(0, 0, 0))
+        env[0, 0, 0, "pheromone-1"] = 1
+        self.assertTrue(env.is_occupied(0, 0, 0))
+        self.assertFalse(env.is_occupied(1, 0, 0))
+        env.evaporate(value=2)
+        self.assertTrue(env.is_occupied(0, 0, 0))
+
+    def test_occupied(self):
+        env = Environment()
+        occupied = env.occupied
+        self.assertNotIn((0, 0, 0), occupied)
+        env[0, 0, 0, "pheromone-1"] = 1
+        self.assertIn((0, 0, 0), occupied)
+        self.assertSetEqual(set(occupied), {(0, 0, 0)})
+
     def test_evaporate(self):
         env = Environment()
         env[0, 0, 0, "pheromone-1"] = 1
@@ -77,6 +119,19 @@ class EnvTest(unittest.TestCase):
         self.assertEqual(env[0, 0, 0, "pheromone-2"], 0)
         self.assertEqual(env[1, 0, 0, "pheromone-1"], 0)
 
+    def test_evaporate_after_exhaustion(self):
+        env = Environment()
+        env[0, 0, 0, "pheromone-1"] = 0.1
+        env[1, 0, 0, "pheromone-1"] = 1
+        env.evaporate(value=0.5)
+        env.evaporate(value=0.5)
+        self.assertEqual(env[0, 0, 0, "pheromone-1"], 0)
+        self.assertEqual(env[1, 0, 0, "pheromone-1"], 0)
+        env[0, 0, 0, "pheromone-1"] = 1
+        env.evaporate(value=0.5)
+        self.assertAlmostEqual(env[0, 0, 0, "pheromone-1"], 0.5)
+        self.assertEqual(env[1, 0, 0, "pheromone-1"], 0)
+
     def test_export(self):
         env = Environment()
         env[0, 0, 0, "pheromone-1"] = 1
@@ -101,6 +156,22 @@ class EnvTest(unittest.TestCase):
             if os.path.isfile(path):
                 os.remove(path)
 
+    def test_export_pheromone(self):
+        env = Environment()
+        env[0, 0, 0, "pheromone-1"] = 1
+        env[0, 0, 0, "pheromone-2"] = 1
+        env[1, 0, 0, "pheromone-1"] = 1
+        env[0, 1, 0, "pheromone-2"] = 1
+        path = os.path.join(tempfile.gettempdir(), "test_export_pheromone.csv")
+        try:
+            env.export(path, pheromone="pheromone-2")
+            with open(path, "r") as f:
+                lines = [line.strip("\n") for line in f.readlines()]
+            self.assertListEqual(sorted(lines), ["0,0,0", "0,1,0"])
+        finally:
+            if os.path.isfile(path):
+                os.remove(path)
+
 
 class PositionTest(unittest.TestCase):
     def test_len_direct_neighbors(self):
@@ -181,6 +252,68 @@ class PositionTest(unittest.TestCase):
         # 25 * 2 cells under the original position
         self.assertEqual(len(list(positions)), 25 * 2 + 24 + 25 * 2)
 
+    def test_total_adjacent_list_partially_above_floor(self):
+        positions = list(adjacent_positions((0, 1, 0), 2))
+        # 25 * 3 cells at y = 0, 2 and 3, y = -1 being under the ground
+        # 24 at the same y-coordinate as the original position
+        self.assertEqual(len(positions), 25 * 3 + 24)
+        self.assertTrue(all(y >= 0 for (_, y, _) in positions))
+
+    def test_adjacent_positions_under_the_ground(self):
+        self.assertListEqual(list(adjacent_positions((0, -5, 0), 2)), [])
+
+    def test_adjacent_positions_within_increment(self):
+        position = (5, 7, -3)
+        for increment in (1, 2, 3):
+            for adjacent in adjacent_positions(position, increment):
+                self.assertTrue(
+                    all(abs(a - p) <= increment for a, p in zip(adjacent, position))
+                )
+
+    def test_pheromone_attractiveness(self):
+        env = Environment()
+        env[1, 0, 0, "move"] = 1
+        env[0, 1, 0, "move"] = 2
+        env[0, 1, 0, "build"] = 3
+        env[1, 1, 0, "build"] = 5
+        self.assertDictEqual(
+            pheromone_attractiveness((0, 0, 0), env, ["move", "build"]),
+            {"move": 3, "build": 3},
+        )
+
+    def test_pheromone_attractiveness_argmax(self):
+        env = Environment()
+        env[1, 0, 0, "move"] = 1
+        env[0, 1, 0, "move"] = 2
+        env[0, 1, 0, "build"] = 4
+        self.assertTupleEqual(
+            pheromone_attractiveness_argmax((0, 0, 0), env, ["move", "build"]),
+            ("build", 4),
+        )
+
+    def test_pheromone_attractiveness_argmax_tie(self):
+        env = Environment()
+        env[1, 0, 0, "move"] = 1
+        env[1, 0, 0, "build"] = 1
+        self.assertTupleEqual(
+            pheromone_attractiveness_argmax((0, 0, 0), env, ["move", "build"]),
+            ("move", 1),
+        )
+        self.assertTupleEqual(
+            pheromone_attractiveness_argmax((0, 0, 0), env, ["build", "move"]),
+            ("build", 1),
+        )
+
+    def test_positions_attractiveness_argmax(self):
+        env = Environment()
+        env[1, 0, 0, "move"] = 1
+        env[0, 1, 0, "build"] = 3
+        positions = [(0, 0, 0), (1, 1, 0), (5, 5, 5)]
+        self.assertDictEqual(
+            positions_attractiveness_argmax(positions, env, ["move", "build"]),
+            {(0, 0, 0): ("build", 3), (1, 1, 0): ("build", 3), (5, 5, 5): ("move", 0)},
+        )
+
 
 class AntTest(unittest.TestCase):
     def test_move_changes_position(self):
@@ -191,6 +324,9 @@ class AntTest(unittest.TestCase):
         ant.act(environment)
         self.assertNotEqual(ant._position, (0, 0, 0))
 
+    def test_ant_has_no_instance_dict(self):
+        self.assertFalse(hasattr(Ant((0, 0, 0)), "__dict__"))
+
     def test_filter_adjacent_positions_has_floor_position(self):
         ant = Ant((0, 0, 0))
         valid_positions = list(
@@ -224,6 +360,19 @@ class AntTest(unittest.TestCase):
         )
         self.assertIn((1, 1, 0), valid_positions)
 
+    def test_filter_adjacent_positions_no_duplicates(self):
+        ant = Ant((1, 1, 1))
+        environment = Environment()
+        environment[0, 0, 0, "pheromone-1"] = 12
+        environment[1, 0, 0, "pheromone-1"] = 12
+        environment[0, 1, 0, "pheromone-1"] = 12
+        valid_positions = list(
+            ant._filter_adjacent_positions(
+                adjacent_positions(ant._position), environment
+            )
+        )
+        self.assertEqual(len(valid_positions), len(set(valid_positions)))
+
     def test_successive_moves(self):
         ant = Ant((0, 0, 0))
         env = Environment()
@@ -232,11 +381,7 @@ class AntTest(unittest.TestCase):
         max_movement = 10
         for _ in range(max_movement):
             ant.act(env)
-        self.assertTrue(
-            (max_movement, max_movement, max_movement)
-            > ant._position
-            > (-max_movement, -max_movement, -max_movement)
-        )
+        self.assertTrue(all(abs(axis) <= max_movement for axis in ant._position))
 
     def test_position_changed_when_no_possible_positions(self):
         # being in y = 2 in an empty env makes it impossible to move
@@ -248,9 +393,9 @@ class AntTest(unittest.TestCase):
     def test_get_most_attractive_position(self):
         ant = Ant((0, 0, 0))
         positions_pheromone = {
-            (1, 0, 0): {"move": 1, "build": 1},
-            (0, 1, 0): {"move": 2, "build": 1},
-            (0, 0, 1): {"move": 0, "build": 1},
+            (1, 0, 0): ("move", 1),
+            (0, 1, 0): ("move", 2),
+            (0, 0, 1): ("build", 1),
         }
         (
             most_attractive_position,
@@ -264,9 +409,9 @@ class AntTest(unittest.TestCase):
     def test_get_random_most_attractive_position(self):
         ant = Ant((0, 0, 0))
         positions_pheromone = {
-            (1, 0, 0): {"move": 1, "build": 1},
-            (0, 1, 0): {"move": 2, "build": 1},
-            (0, 0, 1): {"move": 2, "build": 1},
+            (1, 0, 0): ("move", 1),
+            (0, 1, 0): ("move", 2),
+            (0, 0, 1): ("move", 2),
         }
         (
             most_attractive_position,
@@ -277,6 +422,17 @@ class AntTest(unittest.TestCase):
         self.assertEqual(highest_pheromone, "move")
         self.assertEqual(phero_value, 2)
 
+    def test_ant_random_pheromone_on_tie(self):
+        actions = set()
+        for _ in range(100):
+            ant = Ant((0, 0, 0))
+            environment = Environment()
+            environment[1, 0, 0, "move"] = 1
+            environment[1, 0, 0, "build"] = 1
+            ant.act(environment)
+            actions.update(ant._action_counts)
+        self.assertSetEqual(actions, {"move", "build"})
+
     def test_ant_only_interact_with_move_build_pheromones(self):
         ant = Ant((0, 0, 0), pheromones=["unknown-phero"])
         environment = Environment()
@@ -289,7 +445,7 @@ class AntTest(unittest.TestCase):
         environment = Environment()
         for _ in range(10):
             ant.act(environment)
-        self.assertNotIn("build", ant._actions)
+        self.assertNotIn("build", ant._action_counts)
 
     def test_ant_build_and_move(self):
         ant = Ant((0, 0, 0))
@@ -298,8 +454,19 @@ class AntTest(unittest.TestCase):
         environment[1, 0, 0, "build"] = 1
         for _ in range(25):
             ant.act(environment)
-        self.assertIn("build", ant._actions)
-        self.assertIn("move", ant._actions)
+        self.assertIn("build", ant._action_counts)
+        self.assertIn("move", ant._action_counts)
+
+
+class StepTest(unittest.TestCase):
+    def test_step_acts_and_evaporates(self):
+        ants = [Ant((0, 0, 0)) for _ in range(3)]
+        env = Environment()
+        env[1, 0, 0, "move"] = 1
+        env[1, 0, 0, "build"] = 1
+        step(ants, env)
+        self.assertTrue(all(ant._action_counts for ant in ants))
+        self.assertAlmostEqual(env[1, 0, 0, "move"], 0.95)
 
 
 if __name__ == "__main__":